@@ -1,5 +1,11 @@
 import struct, sys, os.path, plistlib, pprint
 
+AU_HDR = struct.Struct(">III")
+AU_PARAM = struct.Struct(">If")
+
+SUBTYPE_SPP3 = int.from_bytes(b"spp3", "big")
+SUBTYPE_ATSP = int.from_bytes(b"atsp", "big")
+
 LABELS = {
     "spp3": {
         0: {
@@ -154,20 +160,21 @@ Theadroom has no influence on the gain reduction, it just affects stability
 
 
 def dump_audata(labels, data):
+    # Use a memoryview so the per-group slices below don't copy
+    data = memoryview(data)
     top = {}
-    while data:
-        hdr = data[:0xc]
-        data = data[0xc:]
-        typ, grp, cnt = struct.unpack(">III", hdr)
+    off = 0
+    while off < len(data):
+        typ, grp, cnt = AU_HDR.unpack_from(data, off)
+        off += AU_HDR.size
+        end = off + cnt * AU_PARAM.size
+        if end > len(data):
+            raise struct.error(f"au data truncated in group ({typ}, {grp})")
+        names = labels.get(typ, {})
         d = {}
-        for i in range(cnt):
-            blk = data[:0x8]
-            data = data[0x8:]
-            key, val = struct.unpack(">If", blk)
-            if typ in labels:
-                if key in labels[typ]:
-                    key = labels[typ][key]
-            d[key] = val
+        for key, val in AU_PARAM.iter_unpack(data[off:end]):
+            d[names.get(key, key)] = val
+        off = end
         top[(typ, grp)] = d
     pprint.pprint(top, stream=sys.stderr)
     return top
@@ -187,9 +194,8 @@ def process_spp3(e):
     spkrs = ""
     channels = 0
     gbl = d[(0, 0)]
-    for (typ, ch), p in sorted(d.items()):
-        if typ != 4:
-            continue
+    for typ, ch in sorted(k for k in d if k[0] == 4):
+        p = d[(typ, ch)]
         chp = pl["ChannelSpecificParams"][f"Channel{ch}"]
         channels += 2
         spkrs += f"""
@@ -247,6 +253,14 @@ def process_atsp(e):
         assert t_ambient is None or t_ambient == ambient
         t_ambient = ambient
 
+        tr_coil = d[p + "VoiceCoil: thermal resistance [C/Watt]"]
+        tr_magnet = d[p + "Magnet: thermal resistance  [C/Watt]"]
+        tau_coil = d[p + "Voice Coil: thermal time constant [s]"]
+        tau_magnet = d[p + "Magnet: thermal time constant [s]"]
+        t_limit = d[p + "Temperature limit [C]"]
+        t_headroom = d[p + "Temperature hard limit headroom [C]"]
+        z_nominal = d[p + "VoiceCoil: DC resistance [Ohms]"]
+
         for i in range(16):
             if ch & (1 << i):
                 channels += 2
@@ -254,13 +268,13 @@ def process_atsp(e):
 
 [Speaker/{gn}_ch{i}]
 group = {gid}
-tr_coil = {d[p + "VoiceCoil: thermal resistance [C/Watt]"]:.2f}
-tr_magnet = {d[p + "Magnet: thermal resistance  [C/Watt]"]:.2f}
-tau_coil = {d[p + "Voice Coil: thermal time constant [s]"]:.2f}
-tau_magnet = {d[p + "Magnet: thermal time constant [s]"]:.2f}
-t_limit = {d[p + "Temperature limit [C]"]:.1f}
-t_headroom = {d[p + "Temperature hard limit headroom [C]"]:.1f}
-z_nominal = {d[p + "VoiceCoil: DC resistance [Ohms]"]:.2f}
+tr_coil = {tr_coil:.2f}
+tr_magnet = {tr_magnet:.2f}
+tau_coil = {tau_coil:.2f}
+tau_magnet = {tau_magnet:.2f}
+t_limit = {t_limit:.1f}
+t_headroom = {t_headroom:.1f}
+z_nominal = {z_nominal:.2f}
 a_t_20c = 0.0037
 a_t_35c = 0.0037
 is_scale = 3.75
@@ -296,8 +310,8 @@ if __name__ == "__main__":
 
     for s in au["strips"]:
         for e in s["effects"]:
-            if e["unit"]["subtype"].to_bytes(4) == b"spp3":
+            if e["unit"]["subtype"] == SUBTYPE_SPP3:
                 process_spp3(e)
-            if e["unit"]["subtype"].to_bytes(4) == b"atsp":
+            if e["unit"]["subtype"] == SUBTYPE_ATSP:
                 process_atsp(e)
 
@@ -1,7 +1,8 @@
-import json, sys, os.path, configparser
+import json, sys, os.path, configparser, functools
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.signal import butter, sosfilt, freqz
+from scipy.signal import butter, sosfilt, lfilter, freqz
+from scipy.ndimage import uniform_filter1d
 
 CONFDIR = os.path.join(os.path.dirname(__file__), "../conf")
 
@@ -21,16 +22,16 @@ def db(x):
     return 10 ** (x / 20)
 
 def smooth(a, n=3):
-    l = len(a)
-    ret = np.cumsum(a, dtype=float)
-    ret[n:] = ret[n:] - ret[:-n]
-    ret = ret[n - 1:] / n
-    pad = l - len(ret)
-    return np.pad(ret, (pad//2, (pad + 1)//2), "edge")
+    # Even windows: match the centering of the old cumsum implementation
+    origin = -1 if n % 2 == 0 else 0
+    return uniform_filter1d(np.asarray(a, dtype=float), n, mode="nearest",
+                            origin=origin)
 
+@functools.lru_cache
 def butter_lowpass(cutoff, fs, order=5):
     return butter(order, cutoff, fs=fs, btype='low', output="sos", analog=False)
 
+@functools.lru_cache
 def butter_highpass(cutoff, fs, order=5):
     return butter(order, cutoff, fs=fs, btype='high', output="sos", analog=False)
 
@@ -44,9 +45,86 @@ def butter_highpass_filter(data, cutoff, fs, order=5):
     y = sosfilt(sos, data)
     return y
 
+@functools.lru_cache
+def pilot_sos(fs):
+    # Pilot tone band-pass as a single cascade: 100Hz lowpass, then 10Hz highpass
+    return np.vstack((butter_lowpass(100, fs, 6), butter_highpass(10, fs, 3)))
+
 def pilot_filter(data, fs):
-    data = butter_lowpass_filter(data, 100, fs, 6)
-    return butter_highpass_filter(data, 10, fs, 3)
+    return sosfilt(pilot_sos(fs), data)
+
+def thermal_model(p, t_coil, t_magnet, t_ambient, tr_coil, tr_magnet,
+                  alpha_coil, alpha_magnet):
+    # Both stages are first-order IIR filters, so run them with lfilter.
+    # The magnet only depends on ambient + power, and the coil tracks
+    # the magnet temperature from the previous sample.
+    tmag_tgt = t_ambient + p * tr_magnet
+    t_magnet_out, _ = lfilter([alpha_magnet], [1, alpha_magnet - 1], tmag_tgt,
+                              zi=[t_magnet * (1 - alpha_magnet)])
+    t_magnet_prev = np.concatenate(([t_magnet], t_magnet_out[:-1]))
+    tvc_tgt = t_magnet_prev + p * tr_coil
+    t_coil_out, _ = lfilter([alpha_coil], [1, alpha_coil - 1], tvc_tgt,
+                            zi=[t_coil * (1 - alpha_coil)])
+    return tvc_tgt, t_coil_out, tmag_tgt, t_magnet_out
+
+def model_speaker(blocks, idx, sr, isense, vsense,
+                  t_ambient, tr_coil, tr_magnet, tau_coil, tau_magnet):
+    # Independent of Model/Analyzer state, all inputs are passed in
+    samples = sum(blk["sample_count"] for blk in blocks)
+
+    # The recurrence itself runs in float64 (alpha_magnet is ~1e-7 at 48kHz,
+    # below float32 resolution), but the stored traces only need float32.
+    # Time stays float64 so long captures keep sample resolution.
+    m_x = np.empty(samples)
+    m_t_coil_tg = np.empty(samples, dtype=np.float32)
+    m_t_coil = np.empty(samples, dtype=np.float32)
+    m_t_magnet_tg = np.empty(samples, dtype=np.float32)
+    m_t_magnet = np.empty(samples, dtype=np.float32)
+
+    l_x = []
+    l_t_coil = []
+    l_t_magnet = []
+
+    t_coil = blocks[0]["speakers"][idx]["t_coil"]
+    t_magnet = blocks[0]["speakers"][idx]["t_magnet"]
+
+    dt = 1 / sr
+    alpha_coil = dt / (dt + tau_coil)
+    alpha_magnet = dt / (dt + tau_magnet)
+
+    off = 0
+    t = 0
+    for blk in blocks:
+        blk_sr = blk["sample_rate"]
+        cnt = blk["sample_count"]
+        data = blk["speakers"][idx]
+
+        l_x.append(t)
+        l_t_coil.append(data["t_coil"])
+        l_t_magnet.append(data["t_magnet"])
+
+        # Short reads can produce empty blocks; keep the model state as is
+        if not cnt:
+            continue
+
+        tvc_tgt, tc, tmag_tgt, tm = thermal_model(
+            isense[off:off+cnt] * vsense[off:off+cnt], t_coil, t_magnet, t_ambient,
+            tr_coil, tr_magnet, alpha_coil, alpha_magnet)
+
+        t_coil = tc[-1]
+        t_magnet = tm[-1]
+
+        m_x[off:off+cnt] = t + np.arange(cnt) / blk_sr
+        m_t_coil_tg[off:off+cnt] = tvc_tgt
+        m_t_coil[off:off+cnt] = tc
+        m_t_magnet_tg[off:off+cnt] = tmag_tgt
+        m_t_magnet[off:off+cnt] = tm
+
+        t += cnt / blk_sr
+        off += cnt
+
+    return (m_x, m_t_coil_tg, m_t_coil, m_t_magnet_tg, m_t_magnet,
+            np.asarray(l_x), np.asarray(l_t_coil), np.asarray(l_t_magnet))
 
 class Model:
     def __init__(self, idx, an, name, conf):
@@ -72,54 +150,16 @@ class Model:
 
         self.t_ambient = an.fdr["t_ambient"]
 
-        self.t_coil = an.fdr["blocks"][0]["speakers"][self.idx]["t_coil"]
-        self.t_magnet = an.fdr["blocks"][0]["speakers"][self.idx]["t_magnet"]
-
-        self.m_x = []
-        self.m_t_coil_tg = []
-        self.m_t_coil = []
-        self.m_t_magnet_tg = []
-        self.m_t_magnet = []
-
-        self.l_x = []
-        self.l_t_coil = []
-        self.l_t_magnet = []
+        self.isense = an.cvr[:, self.is_chan] * np.float32(self.is_scale)
+        self.vsense = an.cvr[:, self.vs_chan] * np.float32(self.vs_scale)
 
     def run_model(self):
-        off = 0
-        t = 0
-        for blk in self.an.fdr["blocks"]:
-            sr = blk["sample_rate"]
-            cnt = blk["sample_count"]
-            data = blk["speakers"][self.idx]
-
-            isense = self.an.cvr[off:off+cnt, self.is_chan] * self.is_scale
-            vsense = self.an.cvr[off:off+cnt, self.vs_chan] * self.vs_scale
-
-            dt = 1 / self.an.sr
-            alpha_coil = dt / (dt + self.tau_coil)
-            alpha_magnet = dt / (dt + self.tau_magnet)
-
-            self.l_x.append(t)
-            self.l_t_coil.append(data["t_coil"])
-            self.l_t_magnet.append(data["t_magnet"])
-            for x, (i, v) in enumerate(zip(isense, vsense)):
-                self.m_x.append(t + x / sr)
-
-                p = i * v
-
-                tvc_tgt = self.t_magnet + p * self.tr_coil
-                self.t_coil = tvc_tgt * alpha_coil + self.t_coil * (1 - alpha_coil)
-                tmag_tgt = self.t_ambient + p * self.tr_magnet
-                self.t_magnet = tmag_tgt * alpha_magnet + self.t_magnet * (1 - alpha_magnet)
-
-                self.m_t_coil_tg.append(tvc_tgt)
-                self.m_t_coil.append(self.t_coil)
-                self.m_t_magnet_tg.append(tmag_tgt)
-                self.m_t_magnet.append(self.t_magnet)
-
-            t += cnt / sr
-            off += cnt
+        (self.m_x, self.m_t_coil_tg, self.m_t_coil,
+         self.m_t_magnet_tg, self.m_t_magnet,
+         self.l_x, self.l_t_coil, self.l_t_magnet) = model_speaker(
+            self.an.fdr["blocks"], self.idx, self.an.sr,
+            self.isense, self.vsense, self.t_ambient,
+            self.tr_coil, self.tr_magnet, self.tau_coil, self.tau_magnet)
 
     def analyze(self, outfile):
         plt.clf()
@@ -144,19 +184,17 @@ class Model:
         ax1.plot(self.l_x, self.l_t_coil, "om")
         ax1.plot(self.l_x, self.l_t_magnet, "og")
 
-        i = self.an.cvr[:, self.is_chan] * self.is_scale
-        v = self.an.cvr[:, self.vs_chan] * self.vs_scale
+        i = self.isense
+        v = self.vsense
 
         sr = self.an.fdr["sample_rate"]
         ilp = pilot_filter(i, sr)
         vlp = pilot_filter(v, sr)
 
-        p = butter_lowpass_filter(i * v, 10, sr, 1)
-        p = smooth(p, 4000)
-        plp = butter_lowpass_filter(ilp * vlp, 10, sr, 1)
-        plp = smooth(plp, 4000)
-        vlprms_sq = butter_lowpass_filter(vlp * vlp, 10, sr, 1)
-        vlprms_sq = smooth(vlprms_sq, 4000)
+        # Filter and smooth all three power traces in one go (one row each)
+        traces = np.stack((i * v, ilp * vlp, vlp * vlp))
+        traces = butter_lowpass_filter(traces, 10, sr, 1)
+        p, plp, vlprms_sq = smooth(traces, 4000)
         r = vlprms_sq / plp
 
         # ax2.plot(self.m_x, p, "b")
@@ -191,8 +229,9 @@ class Model:
 class Analyzer:
     def __init__(self, base):
         self.fdr = json.load(open(base + ".fdr"))
-        data = open(base + ".cvr", "rb").read()
-        cvr = np.frombuffer(data, dtype="int16").astype("float") / 32768
+        raw = np.memmap(base + ".cvr", dtype=np.int16, mode="r")
+        cvr = raw.astype(np.float32)
+        cvr *= np.float32(1 / 32768)
 
         maker, model = self.fdr["machine"].split(",")
         cf = os.path.join(CONFDIR, maker, model + ".conf")
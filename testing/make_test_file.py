@@ -16,30 +16,32 @@ TEST3 = (1000, 1.5, -6)
 def db(x):
     return 10 ** (x / 20)
 
-def silence(t):
-    return np.zeros(int(FS * t))
-
-def sine(f, t, v):
-    space = np.linspace(0, t, int(FS * t), endpoint=False)
-    return np.sin(2 * np.pi * f * space) * db(v)
-
-signal = np.concatenate((
-    silence(3),
-    sine(*TEST0),
-    silence(2),
-    sine(*TEST1),
-    silence(2),
-    sine(*TEST2),
-    silence(2),
-    sine(*TEST3),
-    silence(5)
-))
-
-space = np.linspace(0, len(signal) / FS, len(signal), endpoint=False)
-signal += np.sin(2 * np.pi * PILOT_FREQ * space) * db(PILOT_DB)
-
-signal = np.concatenate((silence(60), signal))
-
-signal = np.repeat(signal, ch).reshape((-1, ch))
-
-scipy.io.wavfile.write(out, FS, signal.astype("float32"))
+# (frequency, duration, level) of each tone, or None for silence
+SEGMENTS = (
+    (None, 3, None),
+    TEST0,
+    (None, 2, None),
+    TEST1,
+    (None, 2, None),
+    TEST2,
+    (None, 2, None),
+    TEST3,
+    (None, 5, None),
+)
+LEAD_IN = 60
+
+lengths = [int(FS * t) for f, t, v in SEGMENTS]
+samples = sum(lengths)
+freq = np.repeat([f or 0 for f, t, v in SEGMENTS], lengths)
+amp = np.repeat([0 if v is None else db(v) for f, t, v in SEGMENTS], lengths)
+
+# Each tone starts at phase 0, the pilot runs across the whole test
+n = np.arange(samples)
+start = np.repeat(np.cumsum([0] + lengths[:-1]), lengths)
+signal = np.sin(2 * np.pi * freq * ((n - start) / FS)) * amp
+signal += np.sin(2 * np.pi * PILOT_FREQ * (n / FS)) * db(PILOT_DB)
+
+wav = np.zeros((int(FS * LEAD_IN) + samples, ch), dtype="float32")
+wav[-samples:] = signal[:, None]
+
+scipy.io.wavfile.write(out, FS, wav)